@@ -7,15 +7,32 @@
 # Imports
 ##
 
+import base64
+import contextlib
+import gzip
+import io
 import json
+import logging
 import os
+import shutil
+import subprocess
+import sys
 import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch
 
 import pykeepass
+import pykeepass.kdbx_parsing.common as kdbx_common
+from pykeepass.kdbx_parsing import kdf_uuids
 
 from bitwarden_to_keepass import convert
+from test.benchmark import HEAVY_MODULES, generate_vault, startup
 
 ##
 # Globals
@@ -23,6 +40,48 @@ from bitwarden_to_keepass import convert
 
 __MASTER_PASS__ = "123456"
 
+# Stand-in for the bw cli, serves the vault in FAKE_BW_VAULT and records the
+# start and end time of every command in FAKE_BW_LOG
+__FAKE_BW__ = """#!{python}
+import base64
+import json
+import os
+import sys
+import time
+
+args = sys.argv[1:]
+start = time.time()
+time.sleep(float(os.environ.get("FAKE_BW_DELAY", "0")))
+
+with open(os.environ["FAKE_BW_VAULT"], "r", encoding="utf-8") as f_handle:
+    vault = json.load(f_handle)
+
+status = 0
+if args[0] == "unlock":
+    print("fake-session")
+elif args[0] == "list":
+    print(json.dumps(vault[args[1]]))
+elif args[:2] == ["get", "attachment"]:
+    item_id = args[args.index("--itemid") + 1]
+    attachments = [
+        attachment
+        for item in vault["items"]
+        if item["id"] == item_id
+        for attachment in item.get("attachments") or []
+        if attachment["id"] == args[2] and "fakeContent" in attachment
+    ]
+    if attachments:
+        sys.stdout.buffer.write(base64.b64decode(attachments[0]["fakeContent"]))
+    else:
+        print("Not found.", file=sys.stderr)
+        status = 1
+
+with open(os.environ["FAKE_BW_LOG"], "a", encoding="utf-8") as f_handle:
+    f_handle.write(json.dumps([" ".join(args), start, time.time()]) + "\\n")
+
+sys.exit(status)
+"""
+
 
 ##
 # Functions
@@ -69,6 +128,38 @@ def validate_keepass(self):
     return kpo
 
 
+def install_fake_bw(self, vault_file, delay=0):
+    """Put a stand-in bw cli first on PATH for the duration of the test"""
+
+    bin_dir = tempfile.mkdtemp()
+    bw_path = os.path.join(bin_dir, "bw")
+    with open(bw_path, "w", encoding="utf-8") as f_handle:
+        f_handle.write(__FAKE_BW__.format(python=sys.executable))
+    os.chmod(bw_path, 0o755)
+
+    log_file = os.path.join(bin_dir, "log.jsonl")
+    env = {
+        "PATH": bin_dir + os.pathsep + os.environ["PATH"],
+        "FAKE_BW_VAULT": vault_file,
+        "FAKE_BW_LOG": log_file,
+        "FAKE_BW_DELAY": str(delay),
+    }
+    env_patch = patch.dict(os.environ, env)
+    env_patch.start()
+
+    self.addCleanup(env_patch.stop)
+    self.addCleanup(shutil.rmtree, bin_dir)
+
+    def read_log():
+        with open(log_file, "r", encoding="utf-8") as f_handle:
+            return {
+                command: (start, end)
+                for command, start, end in map(json.loads, f_handle)
+            }
+
+    return read_log
+
+
 ##
 # Tests
 ##
@@ -270,6 +361,186 @@ class ExportTest(unittest.TestCase):
             os.unlink(self.output)
 
 
+class ExportStreamTest(unittest.TestCase):
+    """Test if the JSON export is written incrementally"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.json_output = os.path.join(self.tmp_dir, "export.json")
+
+        self.vault = generate_vault(200, seed=6)
+        self.bw_vault = convert.BitWarden(self.vault, __MASTER_PASS__)
+        self.bw_vault.fetch_bitwarden_folders()
+        self.bw_vault.fetch_bitwarden_items()
+
+        self.expected = json.dumps(
+            {
+                "encrypted": False,
+                "folders": self.vault["folders"],
+                "items": self.vault["items"],
+            }
+        ).encode("utf-8")
+
+    def read_output(self):
+        with open(self.json_output, "rb") as f_handle:
+            return f_handle.read()
+
+    def test_export_json(self):
+        """The streamed export matches json.dumps of the whole vault"""
+
+        self.bw_vault.export_json(self.json_output)
+        self.assertEqual(self.read_output(), self.expected)
+
+        self.bw_vault.items = []
+        self.bw_vault.export_json(self.json_output)
+        self.assertEqual(
+            json.loads(self.read_output()),
+            {"encrypted": False, "folders": self.vault["folders"], "items": []},
+        )
+
+    def test_gzip(self):
+        """The export can be compressed with gzip"""
+
+        self.bw_vault.export_json(self.json_output, compression="gzip")
+        self.assertEqual(gzip.decompress(self.read_output()), self.expected)
+
+    @unittest.skipIf(convert.zstd is None, "zstd requires Python 3.14+")
+    def test_zstd(self):
+        """The export can be compressed with zstd"""
+
+        self.bw_vault.export_json(self.json_output, compression="zstd")
+        self.assertEqual(convert.zstd.decompress(self.read_output()), self.expected)
+
+    def test_durable(self):
+        """A failed durable export keeps the previous file and no leftovers"""
+
+        self.bw_vault.export_json(self.json_output, durable=True)
+        self.assertEqual(self.read_output(), self.expected)
+
+        self.bw_vault.items = self.vault["items"] + [{"id": object()}]
+        with self.assertRaises(TypeError):
+            self.bw_vault.export_json(self.json_output, durable=True)
+
+        self.assertEqual(self.read_output(), self.expected)
+        self.assertEqual(os.listdir(self.tmp_dir), ["export.json"])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+class AtomicSaveTest(unittest.TestCase):
+    """Test if the output kdbx is replaced atomically"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmp_dir, "vault.kdbx")
+
+    def convert_vault(self, count):
+        vault = generate_vault(count)
+
+        kp_db = convert.KeePassConvert(self.output, __MASTER_PASS__)
+        kp_db.folders_to_groups(vault["folders"])
+        kp_db.items_to_entries(vault["items"])
+
+        return kp_db
+
+    def read_output(self, path=None):
+        with open(path or self.output, "rb") as f_handle:
+            return f_handle.read()
+
+    def test_save(self):
+        """Nothing is written before save, which reports the bytes written"""
+
+        kp_db = self.convert_vault(20)
+        self.assertFalse(os.path.exists(self.output))
+
+        size, seconds = kp_db.save()
+        self.assertEqual(size, os.path.getsize(self.output))
+        self.assertGreater(seconds, 0)
+        self.assertEqual(os.listdir(self.tmp_dir), ["vault.kdbx"])
+
+        kpo = pykeepass.PyKeePass(self.output, password=__MASTER_PASS__)
+        self.assertEqual(len(kpo.entries), len(kp_db.kp_db.entries))
+
+    def test_read_back(self):
+        """What was written can be read back before the file is renamed"""
+
+        for durable in (False, True):
+            with convert.open_output(self.output, durable=durable) as f_handle:
+                f_handle.write(b"header and payload")
+                f_handle.seek(0)
+                self.assertEqual(f_handle.read(6), b"header")
+                f_handle.seek(0, io.SEEK_END)
+
+            self.assertEqual(self.read_output(), b"header and payload")
+
+    def test_seekable_stream(self):
+        """pykeepass saves into a stream it can seek and read back, as 4.1 does"""
+
+        kp_db = self.convert_vault(20)
+        streams = []
+        save = kp_db.kp_db.save
+
+        def check_stream(stream):
+            streams.append(stream)
+            save(stream)
+            self.assertTrue(stream.seekable())
+            stream.seek(0)
+            self.assertEqual(stream.read(4), b"\x03\xd9\xa2\x9a")
+
+        with patch.object(kp_db.kp_db, "save", side_effect=check_stream):
+            size, _ = kp_db.save()
+
+        self.assertEqual(len(streams), 1)
+        self.assertEqual(size, len(self.read_output()))
+        pykeepass.PyKeePass(self.output, password=__MASTER_PASS__)
+
+    def test_failure(self):
+        """A failed save keeps the previous output and leaves nothing behind"""
+
+        kp_db = self.convert_vault(20)
+        kp_db.save()
+        previous = self.read_output()
+
+        with patch.object(
+            kp_db.kp_db, "save", side_effect=OSError("No space left on device")
+        ):
+            with self.assertRaises(OSError):
+                kp_db.save(backups=1)
+
+        self.assertEqual(self.read_output(), previous)
+        self.assertEqual(os.listdir(self.tmp_dir), ["vault.kdbx"])
+
+    def test_backups(self):
+        """Previous versions are rotated up to the number of backups"""
+
+        versions = []
+        for count in (5, 10, 15):
+            self.convert_vault(count).save(backups=2)
+            versions.append(self.read_output())
+
+        self.assertEqual(
+            sorted(os.listdir(self.tmp_dir)),
+            ["vault.kdbx", "vault.kdbx.1", "vault.kdbx.2"],
+        )
+        self.assertEqual(self.read_output(), versions[2])
+        self.assertEqual(self.read_output(f"{self.output}.1"), versions[1])
+        self.assertEqual(self.read_output(f"{self.output}.2"), versions[0])
+
+    def test_backups_not_durable(self):
+        """Writing in place keeps the backup, even when it is a hard link"""
+
+        for content in (b"old", b"new"):
+            with convert.open_output(self.output, backups=1) as f_handle:
+                f_handle.write(content)
+
+        self.assertEqual(self.read_output(), b"new")
+        self.assertEqual(self.read_output(f"{self.output}.1"), b"old")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
 class NoFolderTest(unittest.TestCase):
     """Test if convert.py can handle vault with no folders"""
 
@@ -577,6 +848,1936 @@ class PatchTest(unittest.TestCase):
             os.unlink(self.patch_kdbx)
 
 
+class BulkInsertTest(unittest.TestCase):
+    """Test if bulk insertion matches the per-entry insertion path"""
+
+    def setUp(self):
+        _, self.output = tempfile.mkstemp()
+
+    def convert_items(self, bulk):
+        """Convert the duplicate fixture and return (group, title, username) tuples"""
+
+        input_file = os.path.join(
+            os.path.dirname(__file__), "resources", "test_duplicate.json"
+        )
+        vault = convert.parse_input_json(input_file)
+
+        kp_db = convert.KeePassConvert(self.output, __MASTER_PASS__)
+        kp_db.folders_to_groups(vault["folders"])
+        kp_db.items_to_entries(vault["items"], bulk=bulk)
+
+        return sorted(
+            (entry.group.name, entry.title, entry.username)
+            for entry in kp_db.kp_db.entries
+        )
+
+    def test_bulk_matches_add_entry(self):
+        """Both insertion paths produce the same entries"""
+
+        self.assertEqual(self.convert_items(True), self.convert_items(False))
+
+    def test_bulk_duplicates(self):
+        """Duplicate titles are suffixed without pykeepass' duplicate check"""
+
+        entries = self.convert_items(True)
+        self.assertIn(("folder2", "pass1 (1)", "admin"), entries)
+
+    def tearDown(self):
+        if os.path.exists(self.output):
+            os.unlink(self.output)
+
+
+class StreamTest(unittest.TestCase):
+    """Test if convert.py can decode the vault incrementally"""
+
+    def setUp(self):
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+
+        _, self.output = tempfile.mkstemp()
+        _, self.json_output = tempfile.mkstemp()
+
+    def test_convert(self):
+        """Stream a file and keep the items for the JSON export"""
+
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+
+        convert.convert(
+            {
+                "sync": False,
+                "input": input_file,
+                "output": self.output,
+                "json": self.json_output,
+                "stream": True,
+            }
+        )
+
+        validate_keepass(self)
+
+        with open(self.json_output, "r", encoding="utf-8") as f_handle:
+            obj = json.loads(f_handle.read())
+        self.assertEqual(len(obj["folders"]), 2)
+        self.assertEqual(len(obj["items"]), 5)
+
+    def test_stdin(self):
+        """Stream a vault piped through stdin"""
+
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+        with open(input_file, "r", encoding="utf-8") as f_handle:
+            stdin = io.StringIO(f_handle.read())
+
+        with patch("sys.stdin", stdin):
+            convert.convert(
+                {
+                    "sync": False,
+                    "input": "-",
+                    "output": self.output,
+                    "json": "",
+                    "stream": True,
+                }
+            )
+
+        validate_keepass(self)
+
+    def test_small_chunks(self):
+        """Values split across reads decode the same as json.loads"""
+
+        input_file = os.path.join(
+            os.path.dirname(__file__), "resources", "test_passkey.json"
+        )
+        with open(input_file, "r", encoding="utf-8") as f_handle:
+            input_str = f_handle.read()
+        expected = json.loads(input_str)
+
+        with patch.object(convert.JsonStream, "CHUNK_SIZE", 7):
+            # Items are requested first, so folders have to be buffered
+            vault = convert.VaultStream(io.StringIO(input_str))
+            self.assertEqual(list(vault.items()), expected["items"])
+            self.assertEqual(list(vault.folders()), expected["folders"])
+
+    def test_encrypted(self):
+        """Encrypted exports are rejected"""
+
+        input_file = os.path.join(
+            os.path.dirname(__file__), "resources", "test_encrypted.json"
+        )
+        vault = convert.parse_input_json(input_file, stream=True)
+
+        with self.assertRaises(SystemExit):
+            list(vault.folders())
+        vault.f_handle.close()
+
+    def tearDown(self):
+        for path in (self.output, self.json_output):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+class ConcurrentFetchTest(unittest.TestCase):
+    """Test if folders and items are listed by concurrent bw commands"""
+
+    def setUp(self):
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+
+        _, self.output = tempfile.mkstemp()
+
+    def run_convert(self, params):
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+        read_log = install_fake_bw(self, input_file, delay=0.5)
+
+        convert.convert(
+            {
+                "sync": False,
+                "input": None,
+                "output": self.output,
+                "json": "",
+                "concurrent_fetch": True,
+                **params,
+            }
+        )
+
+        validate_keepass(self)
+        return read_log()
+
+    def test_convert(self):
+        """Both bw list commands run at the same time"""
+
+        log = self.run_convert({})
+
+        folders_start, folders_end = log["list folders"]
+        items_start, items_end = log["list items"]
+        self.assertLess(items_start, folders_end)
+        self.assertLess(folders_start, items_end)
+
+    def test_stream(self):
+        """Concurrent fetch also works when streaming items"""
+
+        log = self.run_convert({"stream": True})
+        self.assertLess(log["list items"][0], log["list folders"][1])
+
+    def tearDown(self):
+        if os.path.exists(self.output):
+            os.unlink(self.output)
+
+
+class FakeBitWardenServe(BaseHTTPRequestHandler):
+    """Stand-in for the bw serve REST API"""
+
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, data, status=200):
+        body = json.dumps({"success": status == 200, "data": data}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path, self.client_address))
+
+        if self.path.startswith("/object/attachment/"):
+            self.send_attachment()
+            return
+
+        kind = self.path.rsplit("/", 1)[-1]
+        self.reply({"object": "list", "data": self.server.vault[kind]})
+
+    def send_attachment(self):
+        path, _, query = self.path.partition("?")
+        attachment_id = path.rsplit("/", 1)[-1]
+        item_id = query.partition("itemid=")[2]
+
+        for item in self.server.vault["items"]:
+            for attachment in item.get("attachments") or []:
+                if (
+                    item["id"] == item_id
+                    and attachment["id"] == attachment_id
+                    and "fakeContent" in attachment
+                ):
+                    body = base64.b64decode(attachment["fakeContent"])
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+        self.reply(None, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.server.requests.append(("POST", self.path, self.client_address))
+
+        if self.path == "/unlock" and body.get("password") != __MASTER_PASS__:
+            self.reply(None, status=400)
+            return
+
+        self.reply({"object": "message", "raw": "fake-session"})
+
+    def log_message(self, *args):
+        pass
+
+
+class BitWardenServeTest(unittest.TestCase):
+    """Test if convert.py can read the vault through bw serve"""
+
+    def setUp(self):
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+
+        _, self.output = tempfile.mkstemp()
+
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBitWardenServe)
+        self.server.vault = convert.parse_input_json(input_file)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def test_convert(self):
+        """Unlock, sync and list over a single connection"""
+
+        convert.convert(
+            {
+                "sync": True,
+                "input": None,
+                "output": self.output,
+                "json": "",
+                "bw_serve_url": self.url,
+            }
+        )
+
+        validate_keepass(self)
+
+        self.assertEqual(
+            [(method, path) for method, path, _ in self.server.requests],
+            [
+                ("POST", "/unlock"),
+                ("POST", "/sync"),
+                ("GET", "/list/object/folders"),
+                ("GET", "/list/object/items"),
+            ],
+        )
+        self.assertEqual(len({client for _, _, client in self.server.requests}), 1)
+
+    def test_unlock_failure(self):
+        """A failed unlock exits"""
+
+        bw_vault = convert.BitWardenServe("wrong", self.url)
+        with self.assertRaises(SystemExit):
+            bw_vault.unlock_and_get_session()
+        bw_vault.close()
+
+    def test_failure_stops_server(self):
+        """bw serve is stopped when the conversion fails"""
+
+        procs = []
+
+        def start(bw_vault):
+            # A process standing in for bw serve, with the API at self.url
+            bw_vault.port = self.server.server_address[1]
+            bw_vault.proc = subprocess.Popen(
+                [sys.executable, "-c", "import time; time.sleep(60)"]
+            )
+            procs.append(bw_vault.proc)
+
+        with (
+            patch.object(convert.BitWardenServe, "start", start),
+            patch("sys.stderr", io.StringIO()),
+            patch("sys.stdout", io.StringIO()),
+            self.assertRaises(SystemExit),
+        ):
+            convert.convert(
+                {
+                    "sync": False,
+                    "input": None,
+                    "output": self.output,
+                    "json": "",
+                    "password": "wrong",
+                    "bw_serve": True,
+                }
+            )
+
+        self.assertEqual(len(procs), 1)
+        self.assertIsNotNone(procs[0].poll())
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+        if os.path.exists(self.output):
+            os.unlink(self.output)
+
+
+class AttachmentTest(unittest.TestCase):
+    """Test if item attachments are downloaded into the kdbx"""
+
+    def setUp(self):
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+
+        _, self.output = tempfile.mkstemp()
+        _, self.vault_file = tempfile.mkstemp()
+
+        self.vault = generate_vault(30, seed=7)
+        items = self.vault["items"]
+
+        def attachment(attachment_id, file_name, content=None):
+            attachment = {"id": attachment_id, "fileName": file_name, "size": "0"}
+            if content is not None:
+                attachment["fakeContent"] = base64.b64encode(content).decode("ascii")
+            return attachment
+
+        # Two copies of the same file, a distinct one and a missing one
+        items[0]["attachments"] = [
+            attachment("a1", "report.pdf", b"%PDF" + bytes(range(256)) * 64),
+            attachment("a2", "key.txt", b"secret key"),
+        ]
+        items[1]["attachments"] = [
+            attachment("a3", "copy.pdf", b"%PDF" + bytes(range(256)) * 64)
+        ]
+        items[2]["attachments"] = [attachment("a4", "gone.txt")]
+
+        with open(self.vault_file, "w", encoding="utf-8") as f_handle:
+            json.dump(self.vault, f_handle)
+
+    def validate(self):
+        kpo = pykeepass.PyKeePass(self.output, password=__MASTER_PASS__)
+
+        self.assertEqual(len(kpo.binaries), 2)
+        attachments = {
+            attachment.filename: attachment.data for attachment in kpo.attachments
+        }
+        self.assertEqual(set(attachments), {"report.pdf", "key.txt", "copy.pdf"})
+        self.assertEqual(attachments["report.pdf"], attachments["copy.pdf"])
+        self.assertEqual(attachments["key.txt"], b"secret key")
+
+        entry = kpo.find_attachments(filename="key.txt", first=True).entry
+        self.assertEqual(entry.username, self.vault["items"][0]["login"]["username"])
+
+    def test_convert(self):
+        """Attachments are downloaded with bw get attachment and deduplicated"""
+
+        read_log = install_fake_bw(self, self.vault_file)
+
+        stdout = io.StringIO()
+        with (
+            contextlib.redirect_stdout(stdout),
+            self.assertRaises(SystemExit) as context,
+        ):
+            convert.convert(
+                {
+                    "sync": False,
+                    "input": None,
+                    "output": self.output,
+                    "json": "",
+                    "attachments": True,
+                    "attachment_workers": 2,
+                }
+            )
+
+        # The output is saved, without the missing attachment
+        self.assertEqual(context.exception.code, 1)
+        self.assertIn(
+            "Attachments: 2 added, 1 deduplicated, 1 failed.", stdout.getvalue()
+        )
+        self.assertIn(
+            f"get attachment a3 --itemid {self.vault['items'][1]['id']} --raw",
+            read_log(),
+        )
+        self.validate()
+
+    def test_lazy(self):
+        """Attachments go to the entries built by materialize in lazy mode"""
+
+        install_fake_bw(self, self.vault_file)
+
+        with (
+            contextlib.redirect_stdout(io.StringIO()),
+            self.assertRaises(SystemExit),
+        ):
+            convert.convert(
+                {
+                    "sync": False,
+                    "input": None,
+                    "output": self.output,
+                    "json": "",
+                    "attachments": True,
+                    "lazy": True,
+                }
+            )
+
+        self.validate()
+
+    def test_retry(self):
+        """Items whose attachments failed are converted again incrementally"""
+
+        calls = []
+
+        # The first download of a1 fails
+        def download(item_id, attachment_id, f_handle):
+            calls.append(attachment_id)
+            if calls.count("a1") == 1 and attachment_id == "a1":
+                return False
+            f_handle.write(attachment_id.encode())
+            return True
+
+        items = self.vault["items"][:5]
+        items[1]["attachments"] = []
+        items[2]["attachments"] = []
+        manifest_path = self.output + ".manifest"
+        self.addCleanup(os.unlink, manifest_path)
+
+        counts = []
+        for _ in range(2):
+            manifest = convert.Manifest(manifest_path, __MASTER_PASS__)
+            manifest.load()
+            kp_db = convert.KeePassConvert(
+                self.output, __MASTER_PASS__, incremental=True, manifest=manifest
+            )
+            kp_db.folders_to_groups(self.vault["folders"])
+            kp_db.items_to_entries(items)
+            counts.append(kp_db.add_attachments(download))
+            kp_db.save()
+            manifest.save()
+
+        self.assertEqual(counts[0], Counter(added=1, failed=1))
+        self.assertEqual(kp_db.changes["updated"], 1)
+        self.assertEqual(counts[1], Counter(added=1, deduplicated=1))
+        self.assertEqual(sorted(calls), ["a1", "a1", "a2", "a2"])
+
+        kpo = pykeepass.PyKeePass(self.output, password=__MASTER_PASS__)
+        self.assertEqual(
+            sorted(attachment.filename for attachment in kpo.attachments),
+            ["key.txt", "report.pdf"],
+        )
+
+    def test_bw_serve(self):
+        """Attachments can also be downloaded through bw serve"""
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBitWardenServe)
+        server.vault = self.vault
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        with (
+            contextlib.redirect_stdout(io.StringIO()),
+            self.assertRaises(SystemExit),
+        ):
+            convert.convert(
+                {
+                    "sync": False,
+                    "input": None,
+                    "output": self.output,
+                    "json": "",
+                    "bw_serve_url": f"http://127.0.0.1:{server.server_address[1]}",
+                    "attachments": True,
+                }
+            )
+
+        self.validate()
+
+    def tearDown(self):
+        for path in (self.output, self.vault_file):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+class IncrementalTest(unittest.TestCase):
+    """Test if convert.py can update an existing database in place"""
+
+    def setUp(self):
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+
+        _, self.output = tempfile.mkstemp()
+        _, self.input_file = tempfile.mkstemp()
+
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+        with open(input_file, "r", encoding="utf-8") as f_handle:
+            self.vault = json.load(f_handle)
+        for item in self.vault["items"]:
+            item["revisionDate"] = "2023-05-20T10:42:17.406Z"
+
+    def run_convert(self):
+        with open(self.input_file, "w", encoding="utf-8") as f_handle:
+            json.dump(self.vault, f_handle)
+
+        with patch("sys.stdout", io.StringIO()) as stdout:
+            convert.convert(
+                {
+                    "sync": False,
+                    "input": self.input_file,
+                    "output": self.output,
+                    "json": "",
+                    "incremental": True,
+                }
+            )
+
+        return stdout.getvalue()
+
+    def test_convert(self):
+        """Only changed items are replaced"""
+
+        self.assertIn("5 added, 0 updated, 0 deleted", self.run_convert())
+        kpo = validate_keepass(self)
+        uuids = {entry.uuid for entry in kpo.entries}
+
+        self.assertIn("0 added, 0 updated, 0 deleted", self.run_convert())
+        kpo = validate_keepass(self)
+        self.assertEqual({entry.uuid for entry in kpo.entries}, uuids)
+
+        # Change one item, remove another and add a new one
+        changed, removed = self.vault["items"][4], self.vault["items"][0]
+        changed["login"]["password"] = "changed"
+        changed["revisionDate"] = "2024-01-01T00:00:00.000Z"
+        self.vault["items"].remove(removed)
+        self.vault["items"].append(
+            {
+                "id": "new-item",
+                "folderId": None,
+                "type": 2,
+                "name": "new note",
+                "notes": "note",
+                "revisionDate": "2024-01-01T00:00:00.000Z",
+            }
+        )
+
+        self.assertIn("1 added, 1 updated, 1 deleted, 3 unchanged", self.run_convert())
+
+        kpo = pykeepass.PyKeePass(self.output, password=__MASTER_PASS__)
+        self.assertIsNone(kpo.find_entries(title="totp test", first=True))
+        self.assertIsNotNone(
+            kpo.find_entries(title="new note - Secure Note", first=True)
+        )
+
+        pass2 = kpo.find_entries(title="pass2", first=True)
+        self.assertEqual(pass2.password, "changed")
+        self.assertEqual(pass2.get_custom_property("BITWARDEN_ITEM_ID"), changed["id"])
+        self.assertNotIn(pass2.uuid, uuids)
+
+        pass1 = kpo.find_entries(
+            title="pass1", group=kpo.find_groups(name="folder1", first=True), first=True
+        )
+        self.assertIn(pass1.uuid, uuids)
+        self.assertEqual(len(kpo.groups), 3)
+
+    def tearDown(self):
+        for path in (self.output, self.input_file):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+class ManifestTest(unittest.TestCase):
+    """Test if the manifest skips converting unchanged items"""
+
+    def setUp(self):
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+
+        _, self.output = tempfile.mkstemp()
+        self.manifest = self.output + ".manifest"
+
+    def run_convert(self, input_file=None):
+        if input_file is None:
+            input_file = os.path.join(
+                os.path.dirname(__file__), "resources", "test.json"
+            )
+
+        with patch("sys.stdout", io.StringIO()) as stdout:
+            convert.convert(
+                {
+                    "sync": False,
+                    "input": input_file,
+                    "output": self.output,
+                    "json": "",
+                    "incremental": True,
+                    "manifest": self.manifest,
+                }
+            )
+
+        return stdout.getvalue()
+
+    def test_convert(self):
+        """Unchanged items are not converted again"""
+
+        self.run_convert()
+        with open(self.manifest, "rb") as f_handle:
+            self.assertNotIn(b"0e3fba19", f_handle.read())
+
+        item_to_entry = convert.KeePassConvert._KeePassConvert__item_to_entry
+        with patch.object(
+            convert.KeePassConvert,
+            "_KeePassConvert__item_to_entry",
+            side_effect=item_to_entry,
+        ) as mock:
+            output = self.run_convert()
+
+        mock.assert_not_called()
+        self.assertIn("0 added, 0 updated, 0 deleted, 5 unchanged", output)
+        validate_keepass(self)
+
+    def test_folder_rename(self):
+        """Entries of unchanged items follow their renamed folder"""
+
+        self.run_convert()
+
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+        vault = convert.parse_input_json(input_file)
+        for folder in vault["folders"]:
+            if folder["name"] == "folder1":
+                folder["name"] = "renamed/folder1"
+
+        renamed = self.output + ".json"
+        self.addCleanup(os.unlink, renamed)
+        with open(renamed, "w", encoding="utf-8") as f_handle:
+            json.dump(vault, f_handle)
+
+        output = self.run_convert(renamed)
+        self.assertIn("1 updated", output)
+
+        kpo = pykeepass.PyKeePass(self.output, password=__MASTER_PASS__)
+        moved = kpo.find_groups(path=["renamed", "folder1"])
+        self.assertEqual([entry.title for entry in moved.entries], ["pass1"])
+        self.assertEqual(kpo.find_groups(path=["folder1"]).entries, [])
+
+    def test_wrong_password(self):
+        """A manifest that cannot be decrypted is ignored"""
+
+        self.run_convert()
+
+        manifest = convert.Manifest(self.manifest, "wrong")
+        with patch("sys.stderr", io.StringIO()):
+            manifest.load()
+        self.assertEqual(manifest.previous, {})
+
+    def test_requires_incremental(self):
+        """The manifest is only valid for incremental updates"""
+
+        with self.assertRaises(SystemExit):
+            convert.convert(
+                {
+                    "sync": False,
+                    "input": None,
+                    "output": self.output,
+                    "json": "",
+                    "manifest": self.manifest,
+                }
+            )
+
+    def tearDown(self):
+        for path in (self.output, self.manifest):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+class KdfTest(unittest.TestCase):
+    """Test if the key derivation function of the output can be configured"""
+
+    def setUp(self):
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+
+        _, self.output = tempfile.mkstemp()
+
+    def run_convert(self, params):
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+
+        convert.convert(
+            {
+                "sync": False,
+                "input": input_file,
+                "output": self.output,
+                "json": "",
+                **params,
+            }
+        )
+
+        kpo = validate_keepass(self)
+        return kpo, kpo.kdbx.header.value.dynamic_header.kdf_parameters.data.dict
+
+    def test_argon2(self):
+        """Argon2 memory, iterations and parallelism are applied"""
+
+        kpo, kdf_parameters = self.run_convert(
+            {
+                "kdf": "argon2id",
+                "kdf_memory": 8,
+                "kdf_iterations": 3,
+                "kdf_parallelism": 1,
+            }
+        )
+
+        self.assertEqual(kpo.kdf_algorithm, "argon2id")
+        self.assertEqual(kdf_parameters["I"].value, 3)
+        self.assertEqual(kdf_parameters["M"].value, 8 * 1024 * 1024)
+        self.assertEqual(kdf_parameters["P"].value, 1)
+
+    def test_aes(self):
+        """AES-KDF rounds are applied"""
+
+        kpo, kdf_parameters = self.run_convert({"kdf": "aes", "kdf_rounds": 1000})
+
+        self.assertEqual(kpo.kdf_algorithm, "aeskdf")
+        self.assertEqual(kdf_parameters["R"].value, 1000)
+
+    def test_target_ms(self):
+        """The cost is derived from a benchmark of this host"""
+
+        with patch.object(
+            convert.KeePassConvert, "tune_kdf", return_value=5
+        ) as tune_kdf:
+            kpo, kdf_parameters = self.run_convert(
+                {"kdf_target_ms": 100, "kdf_memory": 8}
+            )
+
+        tune_kdf.assert_called_once_with("argon2d", 100, memory=8, parallelism=2)
+        self.assertEqual(kdf_parameters["I"].value, 5)
+        self.assertEqual(kdf_parameters["M"].value, 8 * 1024 * 1024)
+
+    def test_target_ms_incremental(self):
+        """Tuning an existing output uses the memory and parallelism it keeps"""
+
+        self.run_convert(
+            {
+                "kdf": "argon2d",
+                "kdf_memory": 8,
+                "kdf_parallelism": 1,
+                "incremental": True,
+            }
+        )
+
+        with (
+            patch.dict(convert.KeePassConvert.TUNED_KDF, clear=True),
+            patch.object(
+                convert.KeePassConvert, "tune_kdf", return_value=5
+            ) as tune_kdf,
+        ):
+            _, kdf_parameters = self.run_convert(
+                {"kdf_target_ms": 100, "incremental": True}
+            )
+
+        tune_kdf.assert_called_once_with("argon2d", 100, memory=8, parallelism=1)
+        self.assertEqual(kdf_parameters["I"].value, 5)
+        self.assertEqual(kdf_parameters["M"].value, 8 * 1024 * 1024)
+        self.assertEqual(kdf_parameters["P"].value, 1)
+
+    def test_target_ms_aes(self):
+        """AES-KDF rounds are timed at native speed, not pykeepass' loop"""
+
+        sample = 20000
+        start = time.perf_counter()
+        kdbx_common.aes_kdf(os.urandom(32), sample, os.urandom(32))
+        python_rounds = sample * 100 / ((time.perf_counter() - start) * 1000)
+
+        self.assertGreater(
+            convert.KeePassConvert.tune_kdf("aes", 100), python_rounds * 5
+        )
+
+    def tearDown(self):
+        if os.path.exists(self.output):
+            os.unlink(self.output)
+
+
+class GroupIndexTest(unittest.TestCase):
+    """Test if groups are looked up by full path through the group index"""
+
+    def setUp(self):
+        _, self.output = tempfile.mkstemp()
+        _, self.patch_kdbx = tempfile.mkstemp()
+
+    def test_apply_patch(self):
+        """Patch entries land in groups at the same path"""
+
+        patch_db = pykeepass.create_database(self.patch_kdbx, password=__MASTER_PASS__)
+        work = patch_db.add_group(patch_db.root_group, "Work")
+        servers = patch_db.add_group(work, "Servers")
+        patch_db.add_entry(servers, "server1", "root", "secret")
+        patch_db.add_entry(work, "pass1", "admin", "secret")
+        patch_db.save()
+
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+        vault = convert.parse_input_json(input_file)
+
+        kp_db = convert.KeePassConvert(self.output, __MASTER_PASS__)
+        kp_db.folders_to_groups(vault["folders"])
+        kp_db.items_to_entries(vault["items"])
+
+        with (
+            patch.object(kp_db.kp_db, "find_groups", side_effect=AssertionError),
+            patch("sys.stdout", io.StringIO()),
+        ):
+            report = kp_db.apply_patch(self.patch_kdbx, __MASTER_PASS__)
+
+        self.assertEqual(report["counts"]["added"], 2)
+        self.assertEqual(report["counts"]["skipped"], 0)
+
+        server1 = kp_db.kp_db.find_entries(title="server1", first=True)
+        self.assertEqual(server1.group.path, ["Work", "Servers"])
+        self.assertEqual(kp_db._get_or_create_group(("Work", "Servers")), server1.group)
+        self.assertEqual(kp_db._get_or_create_group(()), kp_db.kp_db.root_group)
+
+        # Group names, as taken before paths, still work
+        self.assertEqual(kp_db._get_or_create_group(""), kp_db.kp_db.root_group)
+        self.assertEqual(
+            kp_db._get_or_create_group("Work"), kp_db._get_or_create_group(("Work",))
+        )
+
+    def test_folders_to_groups(self):
+        """Nested folders sharing a name are kept apart"""
+
+        kp_db = convert.KeePassConvert(self.output, __MASTER_PASS__)
+        kp_db.folders_to_groups(
+            [
+                {"id": "1", "name": "Work/Servers"},
+                {"id": "2", "name": "Home/Servers"},
+                {"id": "3", "name": "Work"},
+                {"id": "4", "name": "Home/Servers/Old"},
+                {"id": "5", "name": "No Folder"},
+            ]
+        )
+
+        self.assertEqual(kp_db.groups["1"].path, ["Work", "Servers"])
+        self.assertEqual(kp_db.groups["2"].path, ["Home", "Servers"])
+        self.assertEqual(kp_db.groups["3"].path, ["Work"])
+        self.assertEqual(kp_db.groups["4"].path, ["Home", "Servers", "Old"])
+        self.assertEqual(kp_db.groups["5"], kp_db.kp_db.root_group)
+        self.assertEqual(len(kp_db.kp_db.groups), 6)
+
+    def tearDown(self):
+        for path in (self.output, self.patch_kdbx):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+class MergeTest(unittest.TestCase):
+    """Test if apply_patch merges changed, added and deleted entries"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.base = os.path.join(self.tmp_dir, "base.kdbx")
+        self.output = os.path.join(self.tmp_dir, "output.kdbx")
+        self.patch_kdbx = os.path.join(self.tmp_dir, "patch.kdbx")
+
+        base_db = pykeepass.create_database(self.base, password=__MASTER_PASS__)
+        work = base_db.add_group(base_db.root_group, "Work")
+        for title in ("a", "b", "c", "d", "e"):
+            base_db.add_entry(work, title, "user", "base")
+        base_db.save()
+        shutil.copy(self.base, self.output)
+        shutil.copy(self.base, self.patch_kdbx)
+
+        # a changed and d deleted in the output, b changed and c deleted in the
+        # patch, e changed on both sides and f only added to the patch
+        self.__edit(self.output, {"a": "source", "e": "source"}, "d", 2020)
+        self.__edit(self.patch_kdbx, {"b": "patch", "e": "patch"}, "c", 2030)
+        patch_db = pykeepass.PyKeePass(self.patch_kdbx, password=__MASTER_PASS__)
+        new = patch_db.add_group(patch_db.root_group, "New")
+        patch_db.add_entry(new, "f", "user", "patch")
+        patch_db.save()
+
+    @staticmethod
+    def __edit(path, passwords, deleted, year):
+        kp_db = pykeepass.PyKeePass(path, password=__MASTER_PASS__)
+        for title, password in passwords.items():
+            entry = kp_db.find_entries(title=title, first=True)
+            entry.password = password
+            entry.mtime = datetime(year, 1, 1, tzinfo=timezone.utc)
+        kp_db.delete_entry(kp_db.find_entries(title=deleted, first=True))
+        kp_db.save()
+
+    def __merge(self, **kwargs):
+        kp_db = convert.KeePassConvert(self.output, __MASTER_PASS__, incremental=True)
+        with patch("sys.stdout", io.StringIO()):
+            report = kp_db.apply_patch(self.patch_kdbx, __MASTER_PASS__, **kwargs)
+
+        passwords = {entry.title: entry.password for entry in kp_db.kp_db.entries}
+        return report, passwords
+
+    def test_three_way(self):
+        """One-sided changes and deletions win, conflicts follow the policy"""
+
+        report, passwords = self.__merge(base=(self.base, __MASTER_PASS__))
+
+        self.assertEqual(
+            passwords, {"a": "source", "b": "patch", "e": "source", "f": "patch"}
+        )
+        counts = report["counts"]
+        self.assertEqual(
+            (counts["added"], counts["updated"], counts["deleted"]), (1, 1, 1)
+        )
+        self.assertEqual((counts["conflicts"], counts["unchanged"]), (1, 0))
+
+        reasons = {change["title"]: change["reason"] for change in report["changes"]}
+        self.assertEqual(reasons["c"], "deleted in patch")
+        self.assertEqual(reasons["d"], "deleted in source")
+        self.assertEqual(reasons["e"], "conflict")
+
+        for policy in ("patch-wins", "newest-wins"):
+            _, passwords = self.__merge(
+                base=(self.base, __MASTER_PASS__), policy=policy
+            )
+            self.assertEqual(passwords["e"], "patch")
+
+    def test_two_way(self):
+        """Without a base, nothing is deleted and entries keep their UUID"""
+
+        uuids = {
+            entry.title: entry.uuid
+            for entry in pykeepass.PyKeePass(
+                self.output, password=__MASTER_PASS__
+            ).entries
+        }
+
+        report, passwords = self.__merge()
+        self.assertEqual(
+            passwords,
+            {
+                "a": "source",
+                "b": "base",
+                "c": "base",
+                "d": "base",
+                "e": "source",
+                "f": "patch",
+            },
+        )
+        self.assertEqual(report["counts"]["deleted"], 0)
+
+        kp_db = convert.KeePassConvert(self.output, __MASTER_PASS__, incremental=True)
+        with patch("sys.stdout", io.StringIO()):
+            kp_db.apply_patch(self.patch_kdbx, __MASTER_PASS__, policy="patch-wins")
+        for entry in kp_db.kp_db.entries:
+            if entry.title in uuids:
+                self.assertEqual(entry.uuid, uuids[entry.title])
+        self.assertEqual(
+            kp_db.kp_db.find_entries(title="f", first=True).group.path, ["New"]
+        )
+
+    def test_multiple_patches(self):
+        """Later patches are merged over the entries of earlier ones"""
+
+        second = os.path.join(self.tmp_dir, "second.kdbx")
+        shutil.copy(self.base, second)
+        kp_db = pykeepass.PyKeePass(second, password=__MASTER_PASS__)
+        kp_db.find_entries(title="a", first=True).password = "second"
+        new = kp_db.add_group(kp_db.root_group, "New")
+        kp_db.add_entry(new, "f", "user", "second")
+        kp_db.save()
+
+        args = convert.build_parser().parse_args(
+            ["-o", self.output, "--patch", self.patch_kdbx, second]
+        )
+        self.assertEqual(args.patch, [self.patch_kdbx, second])
+
+        kp_db = convert.KeePassConvert(self.output, __MASTER_PASS__, incremental=True)
+        with patch("sys.stdout", io.StringIO()):
+            report = kp_db.apply_patches(
+                [(self.patch_kdbx, __MASTER_PASS__), (second, __MASTER_PASS__)],
+                policy="patch-wins",
+            )
+
+        passwords = {entry.title: entry.password for entry in kp_db.kp_db.entries}
+        self.assertEqual(passwords["a"], "second")
+        self.assertEqual(passwords["b"], "base")
+        self.assertEqual(passwords["f"], "second")
+        self.assertEqual(len(kp_db.kp_db.find_entries(title="f")), 1)
+
+        self.assertEqual(
+            [patch_report["counts"]["added"] for patch_report in report["patches"]],
+            [2, 0],
+        )
+        self.assertEqual(report["counts"]["updated"], 7)
+        self.assertEqual(
+            {change["patch"] for change in report["changes"]}, {self.patch_kdbx, second}
+        )
+
+    def test_renamed_item(self):
+        """Entries converted from a renamed item are updated, not duplicated"""
+
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+        with open(input_file, "r", encoding="utf-8") as f_handle:
+            vault = json.load(f_handle)
+
+        renamed_input = os.path.join(self.tmp_dir, "renamed.json")
+        item = next(item for item in vault["items"] if item["name"] == "totp test")
+        item["name"] = "totp test-renamed"
+        with open(renamed_input, "w", encoding="utf-8") as f_handle:
+            json.dump(vault, f_handle)
+
+        for path, vault_input in (
+            (self.base, input_file),
+            (self.patch_kdbx, renamed_input),
+        ):
+            os.unlink(path)
+            with patch("sys.stdout", io.StringIO()):
+                convert.convert(
+                    {
+                        "sync": False,
+                        "input": vault_input,
+                        "output": path,
+                        "json": "",
+                        "incremental": True,
+                    }
+                )
+
+        for base in (None, (self.base, __MASTER_PASS__)):
+            shutil.copy(self.base, self.output)
+            kp_db = convert.KeePassConvert(
+                self.output, __MASTER_PASS__, incremental=True
+            )
+            with patch("sys.stdout", io.StringIO()):
+                report = kp_db.apply_patch(
+                    self.patch_kdbx, __MASTER_PASS__, policy="patch-wins", base=base
+                )
+            titles = [
+                entry.title
+                for entry in kp_db.kp_db.entries
+                if entry.get_custom_property(convert.KeePassConvert.ITEM_ID)
+                == item["id"]
+            ]
+            self.assertEqual(titles, ["totp test-renamed"])
+            self.assertEqual(
+                (report["counts"]["added"], report["counts"]["updated"]), (0, 1)
+            )
+
+    def test_incremental(self):
+        """Patched entries keep their item id, and later incremental runs
+        keep them instead of adding the item again"""
+
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+        os.environ["PATCH_PASS"] = __MASTER_PASS__
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+
+        os.unlink(self.output)
+        os.unlink(self.patch_kdbx)
+        patch_db = pykeepass.create_database(self.patch_kdbx, password=__MASTER_PASS__)
+        folder1 = patch_db.add_group(patch_db.root_group, "folder1")
+        patch_db.add_entry(folder1, "pass1", "admin", "patched")
+        patch_db.save()
+
+        for patch_path in (self.patch_kdbx, None):
+            with patch("sys.stdout", io.StringIO()):
+                convert.convert(
+                    {
+                        "sync": False,
+                        "input": input_file,
+                        "output": self.output,
+                        "json": "",
+                        "incremental": True,
+                        "patch": patch_path,
+                        "patch_policy": "patch-wins",
+                    }
+                )
+
+        kpo = pykeepass.PyKeePass(self.output, password=__MASTER_PASS__)
+        entries = kpo.find_groups(path=["folder1"]).entries
+        self.assertEqual([entry.password for entry in entries], ["patched"])
+        self.assertTrue(entries[0].get_custom_property(convert.KeePassConvert.ITEM_ID))
+
+    def test_patch_passwords(self):
+        """Each patch can read its password from its own variable"""
+
+        patch_db = pykeepass.PyKeePass(self.patch_kdbx, password=__MASTER_PASS__)
+        patch_db.password = "team password"
+        patch_db.save()
+
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+        env_patch = patch.dict(
+            os.environ,
+            {
+                "BITWARDEN_PASS": __MASTER_PASS__,
+                "PATCH_PASS": __MASTER_PASS__,
+                "TEAM_PASS": "team password",
+            },
+        )
+        env_patch.start()
+        self.addCleanup(env_patch.stop)
+
+        with patch("sys.stdout", io.StringIO()):
+            convert.convert(
+                {
+                    "sync": False,
+                    "input": input_file,
+                    "output": self.output,
+                    "json": "",
+                    "patch": [f"{self.patch_kdbx}=TEAM_PASS"],
+                    "patch_base": self.base,
+                }
+            )
+        kpo = pykeepass.PyKeePass(self.output, password=__MASTER_PASS__)
+        self.assertIsNotNone(kpo.find_entries(title="f", first=True))
+
+        manifest = os.path.join(self.tmp_dir, "batch.json")
+        with open(manifest, "w", encoding="utf-8") as f_handle:
+            json.dump(
+                {
+                    "jobs": [
+                        {
+                            "input": input_file,
+                            "output": "batch.kdbx",
+                            "patch": [
+                                {"path": "patch.kdbx", "password_env": "TEAM_PASS"}
+                            ],
+                        }
+                    ]
+                },
+                f_handle,
+            )
+        with patch("sys.stdout", io.StringIO()):
+            results = convert.batch(manifest)
+
+        self.assertEqual([status for _, status, _, _ in results], [0])
+        kpo = pykeepass.PyKeePass(
+            os.path.join(self.tmp_dir, "batch.kdbx"), password=__MASTER_PASS__
+        )
+        self.assertIsNotNone(kpo.find_entries(title="f", first=True))
+
+        self.assertEqual(
+            convert.patch_source("a=b.kdbx", "PATCH_PASS"), ("a=b.kdbx", "PATCH_PASS")
+        )
+
+    def test_report(self):
+        """The change report is written as JSON by convert"""
+
+        report_path = os.path.join(self.tmp_dir, "report.json")
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+        os.environ["PATCH_PASS"] = __MASTER_PASS__
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+
+        with patch("sys.stdout", io.StringIO()):
+            convert.convert(
+                {
+                    "sync": False,
+                    "input": input_file,
+                    "output": self.output,
+                    "json": "",
+                    "patch": self.patch_kdbx,
+                    "patch_base": self.base,
+                    "patch_policy": "patch-wins",
+                    "patch_report": report_path,
+                }
+            )
+
+        with open(report_path, encoding="utf-8") as f_handle:
+            report = json.load(f_handle)
+        self.assertEqual(report["counts"]["added"], 3)
+        self.assertEqual(
+            {change["path"] for change in report["changes"]}, {"Work", "New"}
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+class LoggingTest(unittest.TestCase):
+    """Test if progress goes through the logger, quietly or as JSON lines"""
+
+    def setUp(self):
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmp_dir, "output.kdbx")
+        self.log_json = os.path.join(self.tmp_dir, "events.jsonl")
+        self.input_file = os.path.join(
+            os.path.dirname(__file__), "resources", "test.json"
+        )
+
+    def __events(self):
+        with open(self.log_json, encoding="utf-8") as f_handle:
+            return [json.loads(line) for line in f_handle]
+
+    def test_quiet(self):
+        """Quiet runs print nothing, while stage counters reach the JSON log"""
+
+        convert.configure_logging(quiet=True, log_json=self.log_json)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            convert.convert(
+                {
+                    "sync": False,
+                    "input": self.input_file,
+                    "output": self.output,
+                    "json": "",
+                }
+            )
+        self.assertEqual(stdout.getvalue(), "")
+
+        events = self.__events()
+        self.assertIn("Fetching items...", [event["message"] for event in events])
+        self.assertTrue(all(event["message"] for event in events))
+
+        stages = {
+            event["stage"]: event for event in events if event.get("event") == "stage"
+        }
+        self.assertEqual(sum(stages["convert_items"]["counters"].values()), 5)
+        self.assertEqual(
+            stages["save"]["counters"]["bytes"], os.path.getsize(self.output)
+        )
+
+    def test_options(self):
+        """Without handlers set up by the caller, every convert call applies
+        its own options and closes its handlers"""
+
+        for handler in list(convert.LOGGER.handlers):
+            convert.LOGGER.removeHandler(handler)
+
+        params = {
+            "sync": False,
+            "input": self.input_file,
+            "output": self.output,
+            "json": "",
+        }
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            convert.convert(params)
+        self.assertIn("Fetching items...", stdout.getvalue())
+        self.assertEqual(convert.LOGGER.handlers, [])
+
+        with (
+            patch.object(logging.getLogger(), "handlers", [logging.NullHandler()]),
+            contextlib.redirect_stdout(io.StringIO()) as stdout,
+        ):
+            convert.convert({**params, "quiet": True, "log_json": self.log_json})
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertIn(
+            "Fetching items...", [event["message"] for event in self.__events()]
+        )
+        self.assertEqual(convert.LOGGER.handlers, [])
+
+    def test_patch_details(self):
+        """Patched titles are only logged in verbose mode, in batches"""
+
+        patch_kdbx = os.path.join(self.tmp_dir, "patch.kdbx")
+        patch_db = pykeepass.create_database(patch_kdbx, password=__MASTER_PASS__)
+        for index in range(5):
+            patch_db.add_entry(patch_db.root_group, f"secret {index}", "root", "x")
+        patch_db.save()
+
+        def apply(verbose):
+            convert.configure_logging(verbose=verbose, log_json=self.log_json)
+            kp_db = convert.KeePassConvert(self.output, __MASTER_PASS__)
+            with (
+                contextlib.redirect_stdout(io.StringIO()) as stdout,
+                patch.object(convert.KeePassConvert, "DETAIL_BATCH", 2),
+            ):
+                kp_db.apply_patch(patch_kdbx, __MASTER_PASS__)
+            return stdout.getvalue()
+
+        stdout = apply(verbose=False)
+        self.assertIn("Patch patch.kdbx applied: 5 added", stdout)
+        self.assertNotIn("secret", stdout)
+
+        stdout = apply(verbose=True)
+        self.assertIn("  added: [] secret 4 / root (new)", stdout)
+        batches = [
+            event["changes"]
+            for event in self.__events()
+            if event.get("event") == "changes"
+        ]
+        self.assertEqual([len(changes) for changes in batches], [2, 2, 1])
+
+    def tearDown(self):
+        convert.configure_logging()
+        shutil.rmtree(self.tmp_dir)
+
+
+class ProgressTest(unittest.TestCase):
+    """Test if long stages report their progress through a callback"""
+
+    def setUp(self):
+        _, self.output = tempfile.mkstemp()
+
+    def test_rate_and_eta(self):
+        """Updates are throttled to the interval and carry rate and ETA"""
+
+        updates = []
+        with patch("time.monotonic", side_effect=[0, 0.5, 1, 1.5, 2, 2.5]):
+            progress = convert.Progress(updates.append, "stage", total=10, interval=1)
+            for _ in range(4):
+                progress.advance()
+            progress.finish()
+
+        self.assertEqual([update["done"] for update in updates], [2, 4, 4])
+        self.assertEqual(updates[0]["rate"], 2)
+        self.assertEqual(updates[0]["eta"], 4)
+        self.assertEqual(
+            [update["finished"] for update in updates], [False] * 2 + [True]
+        )
+
+    def test_stages(self):
+        """items_to_entries, apply_patch and save call back as they go"""
+
+        vault = generate_vault(50)
+        updates = []
+
+        patch_kdbx = self.output + ".patch"
+        patch_db = pykeepass.create_database(patch_kdbx, password=__MASTER_PASS__)
+        patch_db.add_entry(patch_db.root_group, "patched", "root", "x")
+        patch_db.save()
+        self.addCleanup(os.unlink, patch_kdbx)
+
+        kp_db = convert.KeePassConvert(
+            self.output, __MASTER_PASS__, progress=updates.append, progress_interval=0
+        )
+        kp_db.folders_to_groups(vault["folders"])
+        kp_db.items_to_entries(vault["items"])
+        with patch("sys.stdout", io.StringIO()):
+            kp_db.apply_patch(patch_kdbx, __MASTER_PASS__)
+        size, _ = kp_db.save()
+
+        stages = Counter(update["stage"] for update in updates)
+        self.assertEqual(stages["convert_items"], 51)
+        self.assertEqual(stages["patch"], 2)
+
+        final = {update["stage"]: update for update in updates if update["finished"]}
+        self.assertEqual(final["convert_items"]["done"], 50)
+        self.assertEqual(final["convert_items"]["total"], 50)
+        self.assertEqual(final["patch"]["unit"], "entries")
+        self.assertEqual(final["save"]["done"], size)
+        self.assertEqual(final["save"]["unit"], "bytes")
+        self.assertEqual(final["encrypt"]["done"], 1)
+
+    def test_log(self):
+        """convert logs progress lines only for stages outlasting the interval"""
+
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+        input_file = os.path.join(os.path.dirname(__file__), "resources", "test.json")
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            convert.convert(
+                {"sync": False, "input": input_file, "output": self.output, "json": ""}
+            )
+        self.assertNotIn("/s", stdout.getvalue())
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            convert.log_progress(
+                {
+                    "stage": "convert_items",
+                    "unit": "items",
+                    "done": 500,
+                    "total": 1000,
+                    "elapsed": 2,
+                    "rate": 250,
+                    "eta": 2,
+                    "finished": False,
+                }
+            )
+        self.assertEqual(
+            stdout.getvalue(), "  convert_items: 500/1000 items (250/s, ETA 2s)\n"
+        )
+
+    def tearDown(self):
+        if os.path.exists(self.output):
+            os.unlink(self.output)
+
+
+class MemoryTest(unittest.TestCase):
+    """Test if raw items are released once converted"""
+
+    def setUp(self):
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmp_dir, "output.kdbx")
+
+        # Import pykeepass and its dependencies before tracing
+        convert.KeePassConvert(self.output, __MASTER_PASS__)
+
+    def __convert(self, keep_items):
+        """Return the traced size of the raw vault, and the traced memory left
+        and peak while converting it"""
+
+        tracemalloc.start()
+        try:
+            vault = generate_vault(2000)
+            raw = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+            bw_vault = convert.BitWarden(vault, __MASTER_PASS__, keep_items=keep_items)
+            del vault
+            kp_db = convert.KeePassConvert(self.output, __MASTER_PASS__)
+            kp_db.folders_to_groups(bw_vault.fetch_bitwarden_folders())
+            kp_db.items_to_entries(bw_vault.fetch_bitwarden_items())
+
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertGreaterEqual(len(kp_db.kp_db.entries), 2000)
+        return raw, current, peak
+
+    def test_peak_memory(self):
+        """Items not kept for the JSON export do not outlive their conversion"""
+
+        raw, current, peak = self.__convert(keep_items=True)
+        self.assertGreater(current, raw * 0.8)
+
+        raw, current, peak = self.__convert(keep_items=False)
+        self.assertLess(current, raw * 0.2)
+        self.assertLess(peak, raw * 1.5)
+
+    def test_json_stream(self):
+        """The streamed JSON export matches the one written at the end"""
+
+        input_file = os.path.join(self.tmp_dir, "vault.json")
+        with open(input_file, "w", encoding="utf-8") as f_handle:
+            json.dump(generate_vault(100), f_handle)
+
+        exports = []
+        for json_stream in (False, True):
+            exports.append(os.path.join(self.tmp_dir, f"export{json_stream}.json"))
+            with contextlib.redirect_stdout(io.StringIO()):
+                convert.convert(
+                    {
+                        "sync": False,
+                        "input": input_file,
+                        "output": self.output,
+                        "json": exports[-1],
+                        "json_stream": json_stream,
+                        "json_durable": True,
+                    }
+                )
+
+        with open(exports[0], "rb") as first, open(exports[1], "rb") as second:
+            self.assertEqual(first.read(), second.read())
+        with open(input_file, encoding="utf-8") as f_handle:
+            self.assertEqual(json.load(f_handle), convert.parse_input_json(exports[1]))
+        self.assertEqual(
+            sorted(os.listdir(self.tmp_dir)),
+            ["exportFalse.json", "exportTrue.json", "output.kdbx", "vault.json"],
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+class SyntheticVaultTest(unittest.TestCase):
+    """Test if the benchmark vault generator produces convertible vaults"""
+
+    def setUp(self):
+        _, self.output = tempfile.mkstemp()
+
+    def test_generate_vault(self):
+        """Generated vaults are deterministic and cover every item type"""
+
+        vault = generate_vault(200, seed=1)
+
+        self.assertEqual(vault, generate_vault(200, seed=1))
+        self.assertNotEqual(vault, generate_vault(200, seed=2))
+        self.assertEqual(len(vault["items"]), 200)
+        self.assertEqual({item["type"] for item in vault["items"]}, {1, 2, 3, 4, 5})
+        self.assertTrue(any("/" in folder["name"] for folder in vault["folders"]))
+
+        kp_db = convert.KeePassConvert(self.output, __MASTER_PASS__)
+        kp_db.folders_to_groups(vault["folders"])
+        kp_db.items_to_entries(vault["items"])
+
+        entries = kp_db.kp_db.entries
+        self.assertGreater(len(entries), 200)
+        self.assertTrue(any(entry.title.endswith(" (1)") for entry in entries))
+        self.assertTrue(any("Passkey" in entry.tags for entry in entries))
+
+    def tearDown(self):
+        if os.path.exists(self.output):
+            os.unlink(self.output)
+
+
+class ParallelTest(unittest.TestCase):
+    """Test if items converted in a worker pool match a serial conversion"""
+
+    def setUp(self):
+        _, self.output = tempfile.mkstemp()
+
+    def convert_vault(self, vault, **kwargs):
+        kp_db = convert.KeePassConvert(self.output, __MASTER_PASS__, **kwargs)
+        kp_db.folders_to_groups(vault["folders"])
+        kp_db.items_to_entries(vault["items"])
+
+        return [
+            (
+                entry.group.path,
+                entry.title,
+                entry.username,
+                entry.password,
+                entry.url,
+                entry.notes,
+                entry.otp,
+                entry.tags,
+                entry.custom_properties,
+            )
+            for entry in kp_db.kp_db.entries
+        ]
+
+    def test_items_to_entries(self):
+        """Entries and duplicate suffixes do not depend on the worker pool"""
+
+        vault = generate_vault(600, seed=3)
+        expected = self.convert_vault(vault)
+
+        for executor in ("process", "thread"):
+            with self.subTest(executor=executor):
+                self.assertEqual(
+                    self.convert_vault(vault, workers=2, executor=executor), expected
+                )
+
+    def tearDown(self):
+        if os.path.exists(self.output):
+            os.unlink(self.output)
+
+
+class LazyTest(unittest.TestCase):
+    """Test if lazily built entries match entries added one by one"""
+
+    def setUp(self):
+        _, self.output = tempfile.mkstemp()
+        _, self.lazy_output = tempfile.mkstemp()
+
+    def convert_vault(self, output, vault, **kwargs):
+        kp_db = convert.KeePassConvert(output, __MASTER_PASS__, **kwargs)
+        kp_db.folders_to_groups(vault["folders"])
+        kp_db.items_to_entries(vault["items"])
+        kp_db.save()
+
+        return kp_db
+
+    def read_entries(self, output):
+        kp_db = pykeepass.PyKeePass(output, password=__MASTER_PASS__)
+
+        return [
+            (
+                entry.group.path,
+                entry.title,
+                entry.username,
+                entry.password,
+                entry.url,
+                entry.notes,
+                entry.otp,
+                entry.tags,
+                entry.custom_properties,
+            )
+            for entry in kp_db.entries
+        ]
+
+    def test_save(self):
+        """Entries are only built at materialize time, and match after saving"""
+
+        vault = generate_vault(300, seed=4)
+
+        self.convert_vault(self.output, vault)
+
+        kp_db = convert.KeePassConvert(self.lazy_output, __MASTER_PASS__, lazy=True)
+        kp_db.folders_to_groups(vault["folders"])
+        kp_db.items_to_entries(vault["items"])
+        self.assertEqual(kp_db.kp_db.entries, [])
+
+        kp_db.save()
+        self.assertEqual(kp_db.deferred, [])
+        self.assertEqual(
+            self.read_entries(self.lazy_output), self.read_entries(self.output)
+        )
+
+    def test_incremental(self):
+        """Lazily built entries are tracked for incremental updates"""
+
+        vault = generate_vault(100, seed=5)
+
+        self.convert_vault(self.lazy_output, vault, incremental=True, lazy=True)
+        kp_db = self.convert_vault(self.lazy_output, vault, incremental=True, lazy=True)
+
+        self.assertEqual(kp_db.changes["unchanged"], 100)
+        self.assertEqual(kp_db.changes["added"], 0)
+
+    def tearDown(self):
+        for output in (self.output, self.lazy_output):
+            if os.path.exists(output):
+                os.unlink(output)
+
+
+class ConverterRegistryTest(unittest.TestCase):
+    """Test if item converters can be registered per item type"""
+
+    def setUp(self):
+        _, self.output = tempfile.mkstemp()
+
+    def test_card_properties(self):
+        """Card fields can be stored as custom properties instead of notes"""
+
+        class CardPropertiesConvert(convert.KeePassConvert):
+            pass
+
+        CardPropertiesConvert.register_converter(
+            3,
+            convert.KeePassConvert.section_converter(
+                "card", "Card", username="brand", password="number", properties=True
+            ),
+        )
+        self.assertIsNot(
+            CardPropertiesConvert.CONVERTERS, convert.KeePassConvert.CONVERTERS
+        )
+
+        vault = generate_vault(10)
+        card = next(item for item in vault["items"] if item["type"] == 3)
+
+        kp_db = CardPropertiesConvert(self.output, __MASTER_PASS__)
+        kp_db.folders_to_groups([])
+        kp_db.items_to_entries([card])
+
+        entry = kp_db.kp_db.find_entries(title=f"{card['name']} - Card", first=True)
+        self.assertEqual(entry.username, card["card"]["brand"])
+        self.assertEqual(entry.password, card["card"]["number"])
+        self.assertEqual(entry.notes, card["notes"])
+        self.assertEqual(entry.custom_properties["code"], card["card"]["code"])
+        self.assertEqual(entry.custom_properties["expYear"], card["card"]["expYear"])
+
+        # The base class still adds card fields to the notes
+        _, _, _, _, notes, _ = convert.KeePassConvert._KeePassConvert__item_to_entry(
+            card
+        )
+        self.assertIn(f"code: {card['card']['code']}", notes)
+
+    def test_unknown_type(self):
+        """Unknown item types fail unless a converter is registered"""
+
+        item = {"name": "license", "type": 42, "license": {"key": "ABCD"}}
+
+        class LicenseConvert(convert.KeePassConvert):
+            pass
+
+        with self.assertRaises(Exception):
+            LicenseConvert.convert_item(item)
+
+        LicenseConvert.register_converter(
+            42,
+            convert.KeePassConvert.section_converter(
+                "license", "License", password="key"
+            ),
+        )
+
+        converted = LicenseConvert.convert_item(item)
+        self.assertEqual(converted.title, "license - License")
+        self.assertEqual(converted.password, "ABCD")
+        self.assertEqual(converted.notes, "key: ABCD")
+        self.assertEqual((converted.properties, converted.passkeys), ({}, []))
+
+    def tearDown(self):
+        if os.path.exists(self.output):
+            os.unlink(self.output)
+
+
+class BatchTest(unittest.TestCase):
+    """Test if convert.py can run many conversions in one process"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_file = os.path.join(
+            os.path.dirname(__file__), "resources", "test.json"
+        )
+
+        env_patch = patch.dict(os.environ, {"TEAM_PASS": __MASTER_PASS__})
+        env_patch.start()
+        self.addCleanup(env_patch.stop)
+
+    def test_json(self):
+        """Jobs run in parallel and failures are reported per job"""
+
+        manifest = os.path.join(self.tmp_dir, "batch.json")
+        with open(manifest, "w", encoding="utf-8") as f_handle:
+            json.dump(
+                {
+                    "parallel": 2,
+                    "defaults": {"password_env": "TEAM_PASS", "replace": True},
+                    "jobs": [
+                        {"name": "a", "input": self.input_file, "output": "a.kdbx"},
+                        {"name": "b", "input": self.input_file, "output": "b.kdbx"},
+                        {
+                            "name": "missing",
+                            "input": "missing.json",
+                            "output": "c.kdbx",
+                        },
+                        {
+                            "name": "no password",
+                            "input": self.input_file,
+                            "output": "d.kdbx",
+                            "password_env": "NO_SUCH_PASS",
+                        },
+                    ],
+                },
+                f_handle,
+            )
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            results = convert.batch(manifest)
+
+        self.assertEqual(
+            [(name, status) for name, status, _, _ in results],
+            [("a", 0), ("b", 0), ("missing", 1), ("no password", 1)],
+        )
+        self.assertIn("2 of 4 jobs succeeded.", stdout.getvalue())
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, "d.kdbx")))
+
+        for name in ("a.kdbx", "b.kdbx"):
+            self.output = os.path.join(self.tmp_dir, name)
+            validate_keepass(self)
+
+    def test_job_logging(self):
+        """quiet, verbose and log_json apply per job, events name their job"""
+
+        all_events = os.path.join(self.tmp_dir, "all.jsonl")
+        convert.configure_logging(log_json=all_events)
+        self.addCleanup(convert.configure_logging)
+
+        manifest = os.path.join(self.tmp_dir, "batch.json")
+        with open(manifest, "w", encoding="utf-8") as f_handle:
+            json.dump(
+                {
+                    "parallel": 2,
+                    "defaults": {"password_env": "TEAM_PASS", "input": self.input_file},
+                    "jobs": [
+                        {
+                            "name": "quiet",
+                            "output": "quiet.kdbx",
+                            "quiet": True,
+                            "log_json": "quiet.jsonl",
+                        },
+                        {"name": "loud", "output": "loud.kdbx", "verbose": True},
+                    ],
+                },
+                f_handle,
+            )
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            convert.batch(manifest)
+
+        self.assertNotIn("quiet.kdbx", stdout.getvalue())
+        self.assertIn("loud.kdbx", stdout.getvalue())
+
+        def events(name):
+            with open(os.path.join(self.tmp_dir, name), encoding="utf-8") as f_handle:
+                return [json.loads(line) for line in f_handle]
+
+        quiet_events = events("quiet.jsonl")
+        self.assertIn("stage", [event.get("event") for event in quiet_events])
+        self.assertEqual({event["job"] for event in quiet_events}, {"quiet"})
+        self.assertEqual(
+            {event.get("job") for event in events("all.jsonl")}, {"quiet", "loud"}
+        )
+
+    @unittest.skipIf(sys.version_info < (3, 11), "tomllib requires Python 3.11+")
+    def test_toml(self):
+        """Manifests can be written in TOML and the exit status is set"""
+
+        manifest = os.path.join(self.tmp_dir, "batch.toml")
+        with open(manifest, "w", encoding="utf-8") as f_handle:
+            f_handle.write(
+                "[defaults]\n"
+                'password_env = "TEAM_PASS"\n'
+                "\n"
+                "[[jobs]]\n"
+                f'input = "{self.input_file}"\n'
+                'output = "team.kdbx"\n'
+                'json = "team.json"\n'
+            )
+
+        with (
+            patch.object(sys, "argv", ["convert.py", "--batch", manifest]),
+            contextlib.redirect_stdout(io.StringIO()),
+            self.assertRaises(SystemExit) as context,
+        ):
+            convert.main()
+
+        self.assertEqual(context.exception.code, 0)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, "team.json")))
+
+        self.output = os.path.join(self.tmp_dir, "team.kdbx")
+        validate_keepass(self)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+class StartupTest(unittest.TestCase):
+    """Test if the CLI starts without importing pykeepass and friends"""
+
+    def test_startup(self):
+        """--help, --version and --check do not load heavy dependencies"""
+
+        for args in (["--help"], ["--version"], ["--check"], ["-o", "x", "--kdf", "?"]):
+            with self.subTest(args=args):
+                self.assertEqual(startup(args, runs=1)["heavy_modules"], [])
+
+    def test_check(self):
+        """--check finds every dependency"""
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            self.assertEqual(convert.check(), 0)
+
+        for module in HEAVY_MODULES:
+            self.assertIn(f"{module}: ok", stdout.getvalue())
+
+    def test_kdf_algorithms(self):
+        """The KDF UUIDs match the ones of pykeepass"""
+
+        self.assertEqual(
+            convert.KeePassConvert.KDF_ALGORITHMS,
+            {
+                "argon2d": kdf_uuids["argon2"],
+                "argon2id": kdf_uuids["argon2id"],
+                "aes": kdf_uuids["aeskdf"],
+            },
+        )
+
+
+class ConvertedEntryTest(unittest.TestCase):
+    """Test if items are converted to compact records"""
+
+    def test_convert_item(self):
+        """Records carry everything needed to add the entries of an item"""
+
+        vault = generate_vault(200)
+        item = next(
+            item
+            for item in vault["items"]
+            if len(item.get("login", {}).get("fido2Credentials") or []) > 1
+        )
+
+        converted = convert.KeePassConvert.convert_item(item)
+
+        self.assertFalse(hasattr(converted, "__dict__"))
+        self.assertEqual(converted.title, item["name"])
+        self.assertEqual(converted.username, item["login"]["username"])
+        self.assertEqual(converted.password, item["login"]["password"])
+        self.assertEqual(converted.item_id, item["id"])
+        self.assertEqual(converted.folder_id, item["folderId"])
+        self.assertEqual(converted.revision, item["revisionDate"])
+        self.assertEqual(len(converted.passkeys), 2)
+        self.assertEqual(
+            {key for key, _, _ in converted.passkeys[0]},
+            {
+                "KPEX_PASSKEY_USERNAME",
+                "KPEX_PASSKEY_CREDENTIAL_ID",
+                "KPEX_PASSKEY_PRIVATE_KEY_PEM",
+                "KPEX_PASSKEY_RELYING_PARTY",
+                "KPEX_PASSKEY_USER_HANDLE",
+            },
+        )
+
+
+class MetricsTest(unittest.TestCase):
+    """Test if convert.py can report per-stage metrics"""
+
+    def setUp(self):
+        os.environ["BITWARDEN_PASS"] = __MASTER_PASS__
+
+        _, self.output = tempfile.mkstemp()
+        _, self.metrics_json = tempfile.mkstemp()
+        _, self.json_output = tempfile.mkstemp()
+
+    def test_convert(self):
+        """Every stage is timed and items are counted by type"""
+
+        input_file = os.path.join(
+            os.path.dirname(__file__), "resources", "test_passkey.json"
+        )
+
+        with patch("sys.stderr", io.StringIO()) as stderr:
+            convert.convert(
+                {
+                    "sync": False,
+                    "input": input_file,
+                    "output": self.output,
+                    "json": self.json_output,
+                    "profile": True,
+                    "metrics_json": self.metrics_json,
+                    "tracemalloc": True,
+                }
+            )
+
+        with open(self.metrics_json, "r", encoding="utf-8") as f_handle:
+            report = json.load(f_handle)
+
+        self.assertEqual(
+            [stage["stage"] for stage in report["stages"]],
+            [
+                "parse_input",
+                "fetch_folders",
+                "build_groups",
+                "fetch_items",
+                "convert_items",
+                "save",
+                "export_json",
+            ],
+        )
+        for stage in report["stages"]:
+            self.assertGreaterEqual(stage["wall_s"], 0)
+            self.assertGreaterEqual(stage["cpu_s"], 0)
+            self.assertIn("peak_traced_kb", stage)
+
+        self.assertEqual(report["items_by_type"], {"login": 1})
+        self.assertIn("convert_items", stderr.getvalue())
+
+    def tearDown(self):
+        for path in (self.output, self.metrics_json, self.json_output):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
 ##
 # Main
 ##